@@ -1,12 +1,23 @@
 """CLI entry point."""
 
+import atexit
 import logging
+import logging.handlers
+import queue
 
 import click
 
-from .commands import training_cleanup
+from .commands import fast_remove_cleanup, training_cleanup
 from .settings import Settings
 
+# Shared by the commands which handle several home directories at once.
+workers_option = click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=8,
+    help="Number of home directories to handle in parallel",
+)
+
 
 @click.group()
 @click.option(
@@ -34,8 +45,16 @@ def cli(ctx: click.Context, settings_file: str, dry_run: bool, careful: bool) ->
     ctx.obj["dry_run"] = dry_run
     ctx.obj["careful"] = careful
 
+    # Write log messages from a background thread, so the worker threads doing the
+    # cleanup do not wait on each other for the lock on stderr.
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    atexit.register(listener.stop)
+
     logging.basicConfig(
         level=logging.INFO,
+        handlers=[logging.handlers.QueueHandler(log_queue)],
     )
 
     # Reduce httpx log noise
@@ -46,8 +65,17 @@ def cli(ctx: click.Context, settings_file: str, dry_run: bool, careful: bool) ->
 
 
 @cli.command()
+@workers_option
+@click.option(
+    "--legacy-careful",
+    is_flag=True,
+    default=False,
+    help="In careful mode, prompt for each user in turn instead of all at once",
+)
 @click.pass_context
-def cleanup_training_accounts(ctx: click.Context) -> None:
+def cleanup_training_accounts(
+    ctx: click.Context, workers: int, legacy_careful: bool
+) -> None:
     """Clean up training user accounts."""
     settings = Settings.from_toml(ctx.obj["settings_file"])
 
@@ -55,6 +83,24 @@ def cleanup_training_accounts(ctx: click.Context) -> None:
         settings=settings,
         dry_run=ctx.obj["dry_run"],
         careful=ctx.obj["careful"],
+        workers=workers,
+        legacy_careful=legacy_careful,
+    )
+    command.execute()
+
+
+@cli.command()
+@workers_option
+@click.pass_context
+def cleanup_fast_remove(ctx: click.Context, workers: int) -> None:
+    """Purge home directories moved to the .fast-remove folder."""
+    settings = Settings.from_toml(ctx.obj["settings_file"])
+
+    command = fast_remove_cleanup.FastRemoveCleanupCommand(
+        settings=settings,
+        dry_run=ctx.obj["dry_run"],
+        careful=ctx.obj["careful"],
+        workers=workers,
     )
     command.execute()
 
@@ -1,21 +1,78 @@
+"""Base command class, with the authenticated API client shared by the commands."""
+
+import atexit
+import functools
+import importlib.util
 import logging
-from typing import Optional
+import pathlib
+from typing import Any, Optional
 
 import authlib.integrations.httpx_client
+import httpx
+
+from .. import settings, token_cache
+
+logger = logging.getLogger(__name__)
+
+# Authenticated clients, shared between commands in the same process so that
+# the connection pool and access token are reused. Keyed on everything the client
+# is built from, so commands with different scopes or token caches do not share one.
+_CLIENT_CACHE: dict[
+    tuple[str, str, str, pathlib.Path],
+    authlib.integrations.httpx_client.OAuth2Client,
+] = {}
+
+
+class ApiClient(authlib.integrations.httpx_client.OAuth2Client):
+    """OAuth client which fetches a new token and retries once if the API rejects the current one."""
+
+    def request(
+        self,
+        method: str,
+        url: httpx.URL | str,
+        withhold_token: bool = False,
+        auth: Any = httpx.USE_CLIENT_DEFAULT,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        response: httpx.Response = super().request(
+            method, url, withhold_token=withhold_token, auth=auth, **kwargs
+        )
+        # Token requests themselves are made with the token withheld.
+        if (
+            response.status_code != 401
+            or withhold_token
+            or auth is not httpx.USE_CLIENT_DEFAULT
+        ):
+            return response
+
+        # The token may have been revoked, or the cached one may belong to a stale session.
+        logger.warning("API token was rejected, fetching a new one")
+        access_token = self.token["access_token"]
+        token = self.fetch_token(
+            self.metadata["token_endpoint"], grant_type="client_credentials"
+        )
+        if self.update_token:
+            self.update_token(token, access_token=access_token)
 
-from .. import settings
+        response = super().request(method, url, auth=auth, **kwargs)
+        return response
 
 
 class BaseCommand:
     """Base class for shared authentication."""
 
     def __init__(
-        self, settings: settings.Settings, dry_run: bool = False, careful: bool = False
+        self,
+        settings: settings.Settings,
+        dry_run: bool = False,
+        careful: bool = False,
+        client: Optional[authlib.integrations.httpx_client.OAuth2Client] = None,
     ):
         self.settings = settings
         self.dry_run = dry_run
         self.careful = careful
-        self.client: Optional[authlib.integrations.httpx_client.OAuth2Client] = None
+        # An already authenticated client may be passed in, e.g. by tests.
+        self.client = client
         self.logger = logging.getLogger(self.__class__.__name__)
 
     def get_authenticated_client(
@@ -23,19 +80,74 @@ class BaseCommand:
     ) -> authlib.integrations.httpx_client.OAuth2Client:
         """Get authenticated OAuth client."""
         if self.client is None:
-            self.client = authlib.integrations.httpx_client.OAuth2Client(
+            key = (
                 self.settings.client_id,
-                self.settings.client_secret,
-                scope=" ".join(self.settings.scopes),
-                timeout=5,
-            )
-            self.client.fetch_token(
-                self.settings.token_endpoint, grant_type="client_credentials"
+                self.settings.token_endpoint,
+                " ".join(self.settings.scopes),
+                self.settings.token_cache_file,
             )
-            self.logger.info("Successfully authenticated with JASMIN API")
+            client = _CLIENT_CACHE.get(key)
+            if client is None:
+                # Reuse a token from a previous run if it is still valid.
+                cached_token = token_cache.load_token(
+                    self.settings.token_cache_file,
+                    self.settings.client_id,
+                    self.settings.token_endpoint,
+                    " ".join(self.settings.scopes),
+                )
+
+                # Passing the token endpoint and grant type lets authlib fetch a
+                # new token itself when the current one expires.
+                client = ApiClient(
+                    self.settings.client_id,
+                    self.settings.client_secret,
+                    scope=" ".join(self.settings.scopes),
+                    timeout=5,
+                    limits=httpx.Limits(
+                        max_keepalive_connections=20, max_connections=100
+                    ),
+                    # Multiplex the concurrent per-user requests over one connection,
+                    # with compressed headers, if the optional h2 package is installed.
+                    # httpx already asks for gzip encoded responses.
+                    http2=importlib.util.find_spec("h2") is not None,
+                    token=cached_token,
+                    update_token=functools.partial(_save_token, self.settings),
+                    token_endpoint=self.settings.token_endpoint,
+                    grant_type="client_credentials",
+                )
+                if cached_token is None:
+                    _save_token(
+                        self.settings,
+                        client.fetch_token(
+                            self.settings.token_endpoint,
+                            grant_type="client_credentials",
+                        ),
+                    )
+                    self.logger.info("Successfully authenticated with JASMIN API")
+                else:
+                    self.logger.info("Using cached JASMIN API token")
+                atexit.register(client.close)
+                _CLIENT_CACHE[key] = client
+            self.client = client
 
         return self.client
 
     def execute(self) -> None:
         """Command logic."""
         raise NotImplementedError
+
+
+def _save_token(
+    settings: settings.Settings, token: dict[str, Any], **kwargs: Any
+) -> None:
+    """Write a newly fetched token to the on-disk cache."""
+    try:
+        token_cache.save_token(
+            settings.token_cache_file,
+            settings.client_id,
+            settings.token_endpoint,
+            " ".join(settings.scopes),
+            token,
+        )
+    except OSError as error:
+        logger.warning("Could not cache API token: %s", error)
@@ -0,0 +1,78 @@
+"""Fast-remove folder cleanup command."""
+
+import concurrent.futures
+import pathlib
+import shutil
+
+from typing import Optional
+
+import authlib.integrations.httpx_client
+import click
+
+from .. import settings
+from .base import BaseCommand
+
+
+class FastRemoveCleanupCommand(BaseCommand):
+    """Command to purge home directories which have been moved to .fast-remove."""
+
+    def __init__(
+        self,
+        settings: settings.Settings,
+        dry_run: bool = False,
+        careful: bool = False,
+        workers: int = 1,
+        client: Optional[authlib.integrations.httpx_client.OAuth2Client] = None,
+    ):
+        super().__init__(settings, dry_run=dry_run, careful=careful, client=client)
+        self.workers = workers
+
+    def execute(self) -> None:
+        """Execute the fast-remove cleanup."""
+        fast_remove_folder = self.settings.home_dir_folder / ".fast-remove"
+        if not fast_remove_folder.is_dir():
+            self.logger.info("No fast-remove folder at %s", fast_remove_folder)
+            return
+
+        entries = list(fast_remove_folder.iterdir())
+        if not entries:
+            self.logger.info("Nothing to remove in %s", fast_remove_folder)
+            return
+
+        if self.dry_run:
+            for entry in entries:
+                click.echo(f"[DRY RUN] Would remove {entry}")
+            return
+
+        if self.careful:
+            click.echo(f"{len(entries)} entries in {fast_remove_folder}")
+
+            # Require typing "yes" for destructive operations
+            confirmation: str = click.prompt(
+                "Type 'yes' to permanently remove them, or 'abort' to exit",
+                type=click.Choice(["yes", "abort"], case_sensitive=False),
+            )
+
+            if confirmation == "abort":
+                click.echo("Operation aborted by user")
+                raise click.Abort()
+
+        # Removal is dominated by unlink syscalls, so do several directories at once.
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers
+        ) as executor:
+            for entry, removed in zip(entries, executor.map(self.remove, entries)):
+                if removed:
+                    self.logger.info("Removed %s", entry)
+
+    def remove(self, path: pathlib.Path) -> bool:
+        """Remove a single entry from the fast-remove folder."""
+        try:
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+        except OSError as error:
+            self.logger.error("Failed to remove %s: %s", path, error)
+            return False
+        return True
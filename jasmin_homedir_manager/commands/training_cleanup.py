@@ -1,93 +1,350 @@
 """Training account cleanup command."""
 
+import concurrent.futures
+import dataclasses
+import logging
+import os
 import pathlib
-import shutil
+import stat
 import subprocess
+import uuid
+from typing import Any, Iterator, Optional, TypeVar
 
+import authlib.integrations.httpx_client
 import click
+import httpx
 
+from .. import settings
 from .base import BaseCommand
 
+MKHOMEDIR_HELPER = "/usr/sbin/mkhomedir_helper"
+TRAINING_USERNAME_PREFIX = "train"
+
+T = TypeVar("T")
+
+
+@dataclasses.dataclass
+class Candidate:
+    """A training user awaiting cleanup, and the outcome of checking them."""
+
+    user: dict[str, Any]
+    home_directory: pathlib.Path
+    # Why the user cannot be cleaned up, if they failed a check.
+    reason: Optional[str] = None
+    level: int = logging.ERROR
+
+    @property
+    def ok(self) -> bool:
+        return self.reason is None
+
 
 class TrainingCleanupCommand(BaseCommand):
     """Command to clean up training user accounts."""
 
+    def __init__(
+        self,
+        settings: settings.Settings,
+        dry_run: bool = False,
+        careful: bool = False,
+        workers: int = 1,
+        legacy_careful: bool = False,
+        client: Optional[authlib.integrations.httpx_client.OAuth2Client] = None,
+    ):
+        super().__init__(settings, dry_run=dry_run, careful=careful, client=client)
+        self.workers = workers
+        # Prompt for each user in turn in careful mode, rather than once for all users.
+        self.legacy_careful = legacy_careful
+        self.fast_remove_folder = settings.home_dir_folder / ".fast-remove"
+
     def execute(self) -> None:
         """Execute the training account cleanup."""
         client = self.get_authenticated_client()
 
+        if not self.dry_run:
+            self.fast_remove_folder.mkdir(exist_ok=True)
+
+        # Each user is independent, so several can be handled at once to overlap the network,
+        # filesystem and subprocess waits.
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers
+        ) as executor:
+            # Check all the users before touching any home directories, so the operator
+            # can approve them together and problems are reported in one place.
+            check_futures = {
+                executor.submit(self.check_user, client, user): user
+                for user in self.iter_users(client)
+            }
+            checked = [
+                candidate
+                for _, candidate in self.iter_results(
+                    check_futures, "Failed to check %s"
+                )
+            ]
+            for candidate in checked:
+                if not candidate.ok:
+                    self.logger.log(
+                        candidate.level,
+                        "Did nothing for %s: %s",
+                        candidate.user["username"],
+                        candidate.reason,
+                    )
+            candidates = [candidate for candidate in checked if candidate.ok]
+
+            # Check if careful mode is enabled and confirm with user.
+            if self.careful and self.legacy_careful:
+                approved = []
+                for candidate in candidates:
+                    if self.confirm_user_cleanup(
+                        candidate.user, candidate.home_directory, self.careful
+                    ):
+                        approved.append(candidate)
+                    else:
+                        self.logger.error(
+                            "Careful mode enabled and user asked to skip %s",
+                            candidate.user["username"],
+                        )
+                candidates = approved
+            elif self.careful:
+                candidates = self.confirm_users_cleanup(candidates)
+
+            if self.dry_run:
+                self.report_dry_run(candidates)
+                return
+
+            # Iterate through the approved users doing the cleanup. Whatever happens, any
+            # user whose home directory has gone must be marked dormant.
+            cleanup_futures: dict[concurrent.futures.Future[None], dict[str, Any]] = {}
+            try:
+                for candidate in candidates:
+                    future = executor.submit(self.cleanup_user, candidate)
+                    cleanup_futures[future] = candidate.user
+                for _ in self.iter_results(
+                    cleanup_futures, "Failed to move the home directory of %s"
+                ):
+                    pass
+            finally:
+                # If interrupted, start no more moves but let those underway finish, so
+                # that every user who was moved is known.
+                for future in cleanup_futures:
+                    future.cancel()
+                concurrent.futures.wait(cleanup_futures)
+                cleaned_users = [
+                    user
+                    for future, user in cleanup_futures.items()
+                    if not future.cancelled() and future.exception() is None
+                ]
+
+                # Mark the cleaned up users as dormant in the portal.
+                self.mark_users_dormant(client, cleaned_users, executor)
+
+    def iter_results(
+        self,
+        futures: dict["concurrent.futures.Future[T]", dict[str, Any]],
+        message: str,
+    ) -> Iterator[tuple[dict[str, Any], T]]:
+        """Yield each user with its result, logging and skipping users that failed."""
+        for future, user in futures.items():
+            try:
+                result = future.result()
+            except Exception:
+                self.logger.exception(message, user["username"])
+                continue
+            yield user, result
+
+    def iter_users(
+        self, client: authlib.integrations.httpx_client.OAuth2Client
+    ) -> Iterator[dict[str, Any]]:
+        """Yield training users which need to be cleaned up, a page at a time."""
         # Get a list of all training users which need to be cleaned up from the accounts portal.
-        response = client.get(
-            self.settings.data_endpoints.users,
-            headers={"Accept": "application/json"},
-            params={
-                "user_type": "TRAINING",
-                "lifecycle_state": "AWAITING_CLEANUP",
-                "is_active": "false",
-            },
-        )
+        url: Optional[str] = self.settings.data_endpoints.users
+        params: Optional[dict[str, str]] = {
+            "user_type": "TRAINING",
+            "lifecycle_state": "AWAITING_CLEANUP",
+            "is_active": "false",
+            # Ask for the account details in the list, to save a request per user.
+            "expand": "account",
+        }
+        while url:
+            response = client.get(
+                url, headers={"Accept": "application/json"}, params=params
+            )
+            # Fail clearly if the API still rejects us, rather than on a missing key.
+            response.raise_for_status()
+            page = response.json()
+
+            # Unpaginated responses are a plain list of users.
+            if isinstance(page, list):
+                yield from page
+                return
+
+            yield from page["results"]
+
+            # The next page URL already includes the query parameters.
+            url = page.get("next")
+            params = None
 
-        # Iterate through the users doing the cleanup.
-        for user in response.json():
-            # Get the more detailed view of the user, so we can lookup where LDAP thinks the home directory is.
+    def check_user(
+        self,
+        client: authlib.integrations.httpx_client.OAuth2Client,
+        user: dict[str, Any],
+    ) -> Candidate:
+        """Check whether a training user's home directory can be cleaned up."""
+        # Get the more detailed view of the user, so we can lookup where LDAP thinks the home directory is.
+        # If the portal has already expanded the account details into the list, skip the extra round-trip.
+        if "account" in user:
+            user_detailed = user
+        else:
             response = client.get(user["url"])
             user_detailed = response.json()
 
-            # Get the home directory from LDAP, and also guess the home directory path from the username.
-            home_directory = pathlib.Path(user_detailed["account"]["homeDirectory"])
-            home_directory_constructed = (
-                self.settings.home_dir_folder / user_detailed["username"]
+        username = user["username"]
+
+        # Get the home directory from LDAP, and also guess the home directory path from the username.
+        home_directory = pathlib.Path(user_detailed["account"]["homeDirectory"])
+        home_directory_constructed = (
+            self.settings.home_dir_folder / user_detailed["username"]
+        )
+        candidate = Candidate(user, home_directory)
+
+        # Check user is training account.
+        if not username.startswith(TRAINING_USERNAME_PREFIX):
+            candidate.reason = "the username does not start with train"
+            candidate.level = logging.CRITICAL
+        # Check home path matches that expected.
+        elif home_directory != home_directory_constructed:
+            candidate.reason = (
+                f"home directory in LDAP ({home_directory}) did not match "
+                f"expected ({home_directory_constructed})"
             )
+        # Check home directory is a directory (and not a symlink to one).
+        elif not _is_directory(home_directory):
+            candidate.reason = "home directory did not exist"
 
-            # Check user is training account.
-            if not user["username"].startswith("train"):
-                self.logger.critical(
-                    "Did nothing for %s, since the username does not start with train.",
-                    user["username"],
+        return candidate
+
+    def cleanup_user(self, candidate: Candidate) -> None:
+        """Replace a checked user's home directory with an empty one."""
+        username = candidate.user["username"]
+        self.logger.info("Removing home directory %s", candidate.home_directory)
+
+        # Do the delete. Renaming into .fast-remove is a single syscall on the same
+        # filesystem; the contents are purged later by cleanup-fast-remove.
+        os.rename(
+            candidate.home_directory,
+            self.fast_remove_folder / f"{username}-{uuid.uuid4().hex}",
+        )
+
+        # Make an empty home directory. The old one has already gone, so the user must
+        # still be marked dormant if this fails.
+        try:
+            subprocess.run([MKHOMEDIR_HELPER, username], check=False)
+        except OSError:
+            self.logger.exception("Failed to create a home directory for %s", username)
+
+    def report_dry_run(self, candidates: list[Candidate]) -> None:
+        """Show what would be done for the approved users, without doing it."""
+        if not candidates:
+            click.echo("[DRY RUN] No users would be cleaned up")
+            return
+
+        click.echo(f"[DRY RUN] Would clean up {len(candidates)} users:")
+        click.echo(_format_candidates(dict(enumerate(candidates, start=1))))
+        click.echo(
+            "[DRY RUN] Each home directory would be moved to .fast-remove and replaced "
+            "with an empty one, and the user updated to DORMANT state"
+        )
+
+    def mark_users_dormant(
+        self,
+        client: authlib.integrations.httpx_client.OAuth2Client,
+        users: list[dict[str, Any]],
+        executor: concurrent.futures.Executor,
+    ) -> None:
+        """Set the lifecycle state of cleaned up users to dormant in the portal."""
+        if not users:
+            return
+
+        # Update all the users in one request if the portal has a bulk endpoint.
+        bulk_users = self.settings.data_endpoints.bulk_users
+        if bulk_users is not None:
+            # Setting the state is idempotent, so if the bulk request fails in any way
+            # it is safe to redo any users it may have updated before failing.
+            try:
+                response = client.post(
+                    bulk_users,
+                    json=[
+                        {"url": user["url"], "lifecycle_state": "DORMANT"}
+                        for user in users
+                    ],
                 )
-            # Check home path matches that expected.
-            elif home_directory != home_directory_constructed:
-                self.logger.error(
-                    "Home directory path check failed for %s. Home directory in LDAP (%s) did not match expected (%s)",
-                    user["username"],
-                    home_directory,
-                    home_directory_constructed,
+            except httpx.HTTPError as error:
+                self.logger.warning(
+                    "Bulk update to %s failed (%s), updating users one by one",
+                    bulk_users,
+                    error,
                 )
-            # Check home directory is a directory.
-            elif not home_directory.is_dir():
-                self.logger.error(
-                    "Home directory did not exist for %s", user["username"]
+            else:
+                if not response.is_error:
+                    return
+                self.logger.warning(
+                    "Bulk update to %s failed with status %s, updating users one by one",
+                    bulk_users,
+                    response.status_code,
                 )
-            # Check if careful mode is enabled and confirm with user.
-            elif not self.confirm_user_cleanup(user, home_directory, self.careful):
+
+        futures = {
+            executor.submit(
+                client.patch, user["url"], data={"lifecycle_state": "DORMANT"}
+            ): user
+            for user in users
+        }
+        for user, response in self.iter_results(
+            futures, "Failed to mark %s as dormant"
+        ):
+            if response.is_error:
                 self.logger.error(
-                    "Careful mode enabled and user asked to skip %s", user["username"]
+                    "Failed to mark %s as dormant: status %s",
+                    user["username"],
+                    response.status_code,
                 )
-            else:
-                # This is the main logic.
-                self.logger.info("Removing home directory %s", home_directory)
 
-                if self.dry_run:
-                    click.echo(f"[DRY RUN] Would move {home_directory} to .fast-remove")
-                    click.echo(
-                        f"[DRY RUN] Would create empty home for {user['username']}"
-                    )
-                    click.echo(
-                        f"[DRY RUN] Would update {user['username']} to NORMAL state"
-                    )
-                else:
-                    # Do the delete
-                    shutil.rmtree(home_directory)
+    def confirm_users_cleanup(self, candidates: list[Candidate]) -> list[Candidate]:
+        """Ask for confirmation to clean up all users at once, allowing some to be skipped."""
+        remaining = dict(enumerate(candidates, start=1))
 
-                    # Make an empty home directory.
-                    subprocess.run(
-                        ["/usr/sbin/mkhomedir_helper", user["username"]], check=False
-                    )
+        while remaining:
+            click.echo_via_pager(_format_candidates(remaining))
 
-                    # Mark the user as dormant in the portal.
-                    response = client.patch(
-                        user["url"], data={"lifecycle_state": "DORMANT"}
-                    )
+            # Require typing "yes" for destructive operations
+            answer: str = click.prompt(
+                "Type 'yes' to proceed with cleanup of the users listed, "
+                "the numbers of users to skip (comma separated), or 'abort' to exit"
+            )
+            answer = answer.strip().lower()
+
+            if answer == "abort":
+                click.echo("Operation aborted by user")
+                raise click.Abort()
+            if answer == "yes":
+                return list(remaining.values())
+
+            try:
+                numbers = {int(number) for number in answer.split(",")}
+            except ValueError:
+                click.echo(f"Not a list of numbers: {answer}")
+                continue
+            if not numbers <= remaining.keys():
+                click.echo(f"Unknown numbers: {sorted(numbers - remaining.keys())}")
+                continue
+
+            for number in numbers:
+                candidate = remaining.pop(number)
+                self.logger.error(
+                    "Careful mode enabled and user asked to skip %s",
+                    candidate.user["username"],
+                )
+
+        return []
 
     def confirm_user_cleanup(
         self, user: dict, home_dir: pathlib.Path, careful: bool
@@ -112,3 +369,24 @@ class TrainingCleanupCommand(BaseCommand):
             raise click.Abort()
 
         return confirmation == "yes"
+
+
+def _is_directory(path: pathlib.Path) -> bool:
+    """Check a path is a directory with a single lstat call."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        # Missing, unreadable parent, or a parent which is not a directory.
+        return False
+    return stat.S_ISDIR(st.st_mode)
+
+
+def _format_candidates(candidates: dict[int, Candidate]) -> str:
+    """Format numbered candidates as a table of users and home directories."""
+    return "\n".join(
+        [f"{'#':>4}  {'User':<20} Home Directory"]
+        + [
+            f"{number:>4}  {candidate.user['username']:<20} {candidate.home_directory}"
+            for number, candidate in candidates.items()
+        ]
+    )
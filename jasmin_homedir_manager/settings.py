@@ -1,18 +1,31 @@
+import os
 import pathlib
-from typing import TypeVar
+import sys
+from typing import Optional, TypeVar, cast
 
 import pydantic
-import pydantic_settings
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
 
 SettingsT = TypeVar("SettingsT", bound="Settings")
 
+# Loaded settings, keyed by class and file path, along with the file's mtime, size
+# and inode.
+_SETTINGS_CACHE: dict[tuple[type, str], tuple[tuple[int, int, int], "Settings"]] = {}
+
 
 class DataEndpoints(pydantic.BaseModel):
     users: str
+    bulk_users: Optional[str] = None
 
 
-class Settings(pydantic_settings.BaseSettings):
-    model_config = pydantic_settings.SettingsConfigDict(extra="forbid")
+class Settings(pydantic.BaseModel):
+    # Settings only ever come from a TOML file, so a plain model is enough; there is no
+    # need for the environment, dotenv and secrets file sources of BaseSettings.
+    model_config = pydantic.ConfigDict(extra="forbid")
 
     client_id: str
     client_secret: str
@@ -20,42 +33,24 @@ class Settings(pydantic_settings.BaseSettings):
     token_endpoint: str
     home_dir_folder: pathlib.Path
     data_endpoints: DataEndpoints
-
-    @classmethod
-    def settings_customise_sources(
-        cls,
-        settings_cls: type[pydantic_settings.BaseSettings],
-        init_settings: pydantic_settings.PydanticBaseSettingsSource,
-        env_settings: pydantic_settings.PydanticBaseSettingsSource,
-        dotenv_settings: pydantic_settings.PydanticBaseSettingsSource,
-        file_secret_settings: pydantic_settings.PydanticBaseSettingsSource,
-    ) -> tuple[pydantic_settings.PydanticBaseSettingsSource, ...]:
-        return (
-            init_settings,
-            pydantic_settings.TomlConfigSettingsSource(
-                settings_cls, toml_file="settings.toml"
-            ),
-        )
+    token_cache_file: pathlib.Path = (
+        pathlib.Path.home() / ".cache" / "jasmin-homedir-manager" / "token.json"
+    )
 
     @classmethod
     def from_toml(cls: type[SettingsT], toml_file: str | pathlib.Path) -> SettingsT:
         """Load settings from a specific TOML file."""
-
-        class _SettingsFromToml(cls):  # type: ignore[misc, valid-type]
-            @classmethod
-            def settings_customise_sources(
-                cls,
-                settings_cls: type[pydantic_settings.BaseSettings],
-                init_settings: pydantic_settings.PydanticBaseSettingsSource,
-                env_settings: pydantic_settings.PydanticBaseSettingsSource,
-                dotenv_settings: pydantic_settings.PydanticBaseSettingsSource,
-                file_secret_settings: pydantic_settings.PydanticBaseSettingsSource,
-            ) -> tuple[pydantic_settings.PydanticBaseSettingsSource, ...]:
-                return (
-                    init_settings,
-                    pydantic_settings.TomlConfigSettingsSource(
-                        settings_cls, toml_file=toml_file
-                    ),
-                )
-
-        return _SettingsFromToml()
+        path = str(pathlib.Path(toml_file).resolve())
+
+        # Reuse the settings from the last load, unless the file has changed since. The
+        # size and inode catch edits within the mtime resolution, and replaced files.
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        cached = _SETTINGS_CACHE.get((cls, path))
+        if cached is None or cached[0] != version:
+            with open(path, "rb") as f:
+                cached = (version, cls.model_validate(tomllib.load(f)))
+            _SETTINGS_CACHE[(cls, path)] = cached
+
+        # Hand out a copy, so callers changing their settings do not affect each other.
+        return cast(SettingsT, cached[1].model_copy(deep=True))
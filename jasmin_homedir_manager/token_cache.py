@@ -0,0 +1,78 @@
+"""On-disk cache of the API access token, shared between CLI invocations."""
+
+import os
+import pathlib
+import tempfile
+import time
+from typing import Any, Optional
+
+import pydantic
+
+# Tokens closer than this to expiry are not reused.
+MIN_REMAINING_LIFETIME = 60
+
+
+class CachedToken(pydantic.BaseModel):
+    client_id: str
+    token_endpoint: str
+    scope: str
+    access_token: str
+    token_type: str
+    expires_at: float
+
+
+def load_token(
+    path: pathlib.Path, client_id: str, token_endpoint: str, scope: str
+) -> Optional[dict[str, Any]]:
+    """Load a cached token, if there is a valid one for this client."""
+    try:
+        cached = CachedToken.model_validate_json(path.read_bytes())
+    except (OSError, pydantic.ValidationError):
+        return None
+
+    if (cached.client_id, cached.token_endpoint, cached.scope) != (
+        client_id,
+        token_endpoint,
+        scope,
+    ):
+        return None
+    if cached.expires_at - time.time() <= MIN_REMAINING_LIFETIME:
+        return None
+
+    return cached.model_dump(include={"access_token", "token_type", "expires_at"})
+
+
+def save_token(
+    path: pathlib.Path,
+    client_id: str,
+    token_endpoint: str,
+    scope: str,
+    token: dict[str, Any],
+) -> None:
+    """Save a token to the cache, readable only by the current user."""
+    # Without an expiry time there is no way to tell when the token stops being valid.
+    if "expires_at" not in token:
+        return
+
+    cached = CachedToken(
+        client_id=client_id,
+        token_endpoint=token_endpoint,
+        scope=scope,
+        access_token=token["access_token"],
+        token_type=token["token_type"],
+        expires_at=token["expires_at"],
+    )
+
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    # Write to a temporary file, which mkstemp creates with 0600 permissions and a name
+    # unique to this call, then move it into place so a concurrent reader never sees a
+    # partial file and concurrent writers never share a temporary file.
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(cached.model_dump_json())
+        os.replace(temp_name, path)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
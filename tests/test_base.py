@@ -0,0 +1,226 @@
+"""Tests for the shared command base class."""
+
+import pathlib
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import httpx
+
+from jasmin_homedir_manager import token_cache
+from jasmin_homedir_manager.commands import base
+from jasmin_homedir_manager.settings import Settings
+
+
+class TestBaseCommand(unittest.TestCase):
+    def setUp(self):
+        """Create settings and isolate the client cache."""
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.token_cache_file = pathlib.Path(self.temp_dir) / "token.json"
+
+        self.test_settings = Settings(
+            client_id="test_client",
+            client_secret="test_secret",
+            scopes=["test.scope"],
+            token_endpoint="https://test.example.com/oauth/token/",
+            home_dir_folder=pathlib.Path("/tmp/test_home"),
+            data_endpoints={"users": "https://test.example.com/api/users/"},
+            token_cache_file=self.token_cache_file,
+        )
+
+        patcher = unittest.mock.patch.dict(base._CLIENT_CACHE, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_authenticated_client_reuses_client_between_commands(self):
+        """Test that commands with the same credentials share one client."""
+        with unittest.mock.patch(
+            "jasmin_homedir_manager.commands.base.ApiClient"
+        ) as mock_client_class:
+            mock_client_class.return_value.fetch_token.return_value = {
+                "access_token": "test_token",
+                "token_type": "Bearer",
+                "expires_at": time.time() + 3600,
+            }
+
+            first = base.BaseCommand(self.test_settings).get_authenticated_client()
+            second = base.BaseCommand(self.test_settings).get_authenticated_client()
+
+            self.assertIs(first, second)
+            mock_client_class.assert_called_once()
+            first.fetch_token.assert_called_once_with(
+                "https://test.example.com/oauth/token/",
+                grant_type="client_credentials",
+            )
+
+            # Verify the token was cached for the next run
+            self.assertIsNotNone(
+                token_cache.load_token(
+                    self.token_cache_file,
+                    "test_client",
+                    "https://test.example.com/oauth/token/",
+                    "test.scope",
+                )
+            )
+
+    def test_get_authenticated_client_separates_scopes(self):
+        """Test that commands asking for different scopes get their own clients."""
+        other_settings = self.test_settings.model_copy(
+            update={"scopes": ["other.scope"]}
+        )
+
+        with unittest.mock.patch(
+            "jasmin_homedir_manager.commands.base.ApiClient"
+        ) as mock_client_class:
+            mock_client_class.return_value.fetch_token.return_value = {
+                "access_token": "test_token",
+                "token_type": "Bearer",
+                "expires_at": time.time() + 3600,
+            }
+
+            base.BaseCommand(self.test_settings).get_authenticated_client()
+            base.BaseCommand(other_settings).get_authenticated_client()
+
+            self.assertEqual(
+                [call.kwargs["scope"] for call in mock_client_class.call_args_list],
+                ["test.scope", "other.scope"],
+            )
+
+    def test_get_authenticated_client_uses_http2_if_installed(self):
+        """Test that HTTP/2 is only asked for when the h2 package is installed."""
+        for spec, http2 in [(unittest.mock.sentinel.spec, True), (None, False)]:
+            with self.subTest(http2=http2):
+                base._CLIENT_CACHE.clear()
+
+                with unittest.mock.patch(
+                    "jasmin_homedir_manager.commands.base.ApiClient"
+                ) as mock_client_class, unittest.mock.patch(
+                    "importlib.util.find_spec", return_value=spec
+                ) as mock_find_spec:
+                    mock_client_class.return_value.fetch_token.return_value = {
+                        "access_token": "test_token",
+                        "token_type": "Bearer",
+                        "expires_at": time.time() + 3600,
+                    }
+
+                    base.BaseCommand(self.test_settings).get_authenticated_client()
+
+                    mock_find_spec.assert_called_once_with("h2")
+                    self.assertIs(mock_client_class.call_args.kwargs["http2"], http2)
+
+    def test_get_authenticated_client_uses_cached_token(self):
+        """Test that a valid cached token is used without fetching a new one."""
+        token_cache.save_token(
+            self.token_cache_file,
+            "test_client",
+            "https://test.example.com/oauth/token/",
+            "test.scope",
+            {
+                "access_token": "cached_token",
+                "token_type": "Bearer",
+                "expires_at": time.time() + 3600,
+            },
+        )
+
+        with unittest.mock.patch(
+            "jasmin_homedir_manager.commands.base.ApiClient"
+        ) as mock_client_class:
+            client = base.BaseCommand(self.test_settings).get_authenticated_client()
+
+            self.assertEqual(
+                mock_client_class.call_args.kwargs["token"]["access_token"],
+                "cached_token",
+            )
+            client.fetch_token.assert_not_called()
+
+    def test_get_authenticated_client_callbacks_do_not_hold_command(self):
+        """Test that the shared client's token callback does not hold a command."""
+        with unittest.mock.patch(
+            "jasmin_homedir_manager.commands.base.ApiClient"
+        ) as mock_client_class:
+            mock_client_class.return_value.fetch_token.return_value = {
+                "access_token": "test_token",
+                "token_type": "Bearer",
+                "expires_at": time.time() + 3600,
+            }
+            command = base.BaseCommand(self.test_settings)
+            command.get_authenticated_client()
+
+            update_token = mock_client_class.call_args.kwargs["update_token"]
+            self.assertNotIn(command, update_token.args)
+            self.assertIs(update_token.args[0], self.test_settings)
+
+    def test_get_authenticated_client_uses_given_client(self):
+        """Test that a client passed to the command is used without authenticating."""
+        client = unittest.mock.MagicMock()
+
+        with unittest.mock.patch(
+            "jasmin_homedir_manager.commands.base.ApiClient"
+        ) as mock_client_class:
+            command = base.BaseCommand(self.test_settings, client=client)
+
+            self.assertIs(command.get_authenticated_client(), client)
+            mock_client_class.assert_not_called()
+
+
+class TestApiClient(unittest.TestCase):
+    def setUp(self):
+        """Create a client whose token the API rejects once."""
+        self.requests = []
+
+        def handler(request):
+            self.requests.append(request)
+            if request.url.path == "/oauth/token/":
+                return httpx.Response(
+                    200,
+                    json={
+                        "access_token": "new_token",
+                        "token_type": "Bearer",
+                        "expires_in": 3600,
+                    },
+                )
+            if request.headers.get("Authorization") == "Bearer new_token":
+                return httpx.Response(200, json=[])
+            return httpx.Response(401)
+
+        self.update_token = unittest.mock.Mock()
+        self.client = base.ApiClient(
+            "test_client",
+            "test_secret",
+            token={
+                "access_token": "revoked_token",
+                "token_type": "Bearer",
+                "expires_at": time.time() + 3600,
+            },
+            update_token=self.update_token,
+            token_endpoint="https://test.example.com/oauth/token/",
+            grant_type="client_credentials",
+            transport=httpx.MockTransport(handler),
+        )
+        self.addCleanup(self.client.close)
+
+    def test_request_retries_after_new_token(self):
+        """Test that a rejected request is retried once with a new token."""
+        response = self.client.get("https://test.example.com/api/users/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [request.url.path for request in self.requests],
+            ["/api/users/", "/oauth/token/", "/api/users/"],
+        )
+        self.update_token.assert_called_once()
+        self.assertEqual(
+            self.update_token.call_args.kwargs["access_token"], "revoked_token"
+        )
+
+    def test_request_without_token_is_not_retried(self):
+        """Test that a request made without the token is not retried."""
+        response = self.client.request(
+            "GET", "https://test.example.com/api/users/", withhold_token=True
+        )
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(self.requests), 1)
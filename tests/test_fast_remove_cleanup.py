@@ -0,0 +1,103 @@
+"""Tests for the fast-remove folder cleanup command."""
+
+import pathlib
+import tempfile
+import unittest
+import unittest.mock
+
+import click
+
+from jasmin_homedir_manager.commands.fast_remove_cleanup import (
+    FastRemoveCleanupCommand)
+from jasmin_homedir_manager.settings import Settings
+
+
+class TestFastRemoveCleanupCommand(unittest.TestCase):
+
+    def setUp(self):
+        """Create fake filesystem with some removed home directories."""
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.temp_home_dir = pathlib.Path(self.temp_dir) / "home" / "users"
+        self.fast_remove_dir = self.temp_home_dir / ".fast-remove"
+        self.fast_remove_dir.mkdir(parents=True)
+
+        self.test_settings = Settings(
+            client_id="test_client",
+            client_secret="test_secret",
+            scopes=["test.scope"],
+            token_endpoint="https://test.example.com/oauth/token/",
+            home_dir_folder=self.temp_home_dir,
+            data_endpoints={"users": "https://test.example.com/api/users/"},
+        )
+
+    def create_removed_home_directory(self, name: str) -> pathlib.Path:
+        """Create a home directory which has been moved to .fast-remove."""
+        removed_home = self.fast_remove_dir / name
+        (removed_home / "test_dir").mkdir(parents=True)
+        (removed_home / "test_file.txt").touch()
+        (removed_home / "test_dir" / "nested_file.txt").touch()
+        return removed_home
+
+    def test_execute_removes_all_entries(self):
+        """Test that everything in .fast-remove is deleted."""
+        removed_homes = [
+            self.create_removed_home_directory(f"train00{i}-abc") for i in range(3)
+        ]
+
+        command = FastRemoveCleanupCommand(
+            self.test_settings, dry_run=False, careful=False, workers=3
+        )
+        command.execute()
+
+        for removed_home in removed_homes:
+            self.assertFalse(removed_home.exists())
+        self.assertTrue(self.fast_remove_dir.is_dir())
+
+    def test_execute_with_dry_run_mode(self):
+        """Test dry run mode doesn't remove anything."""
+        removed_home = self.create_removed_home_directory("train001-abc")
+
+        command = FastRemoveCleanupCommand(
+            self.test_settings, dry_run=True, careful=False
+        )
+        command.execute()
+
+        self.assertTrue((removed_home / "test_file.txt").exists())
+
+    def test_execute_with_careful_mode_yes(self):
+        """Test that typing yes removes everything."""
+        removed_home = self.create_removed_home_directory("train001-abc")
+
+        command = FastRemoveCleanupCommand(
+            self.test_settings, dry_run=False, careful=True
+        )
+
+        with unittest.mock.patch("click.prompt", return_value="yes"):
+            command.execute()
+
+        self.assertFalse(removed_home.exists())
+
+    def test_execute_with_careful_mode_abort(self):
+        """Test that aborting at the confirmation removes nothing."""
+        removed_home = self.create_removed_home_directory("train001-abc")
+
+        command = FastRemoveCleanupCommand(
+            self.test_settings, dry_run=False, careful=True
+        )
+
+        with unittest.mock.patch("click.prompt", return_value="abort"):
+            with self.assertRaises(click.Abort):
+                command.execute()
+
+        self.assertTrue(removed_home.exists())
+
+    def test_execute_without_fast_remove_folder(self):
+        """Test that a missing .fast-remove folder is not an error."""
+        self.fast_remove_dir.rmdir()
+
+        command = FastRemoveCleanupCommand(
+            self.test_settings, dry_run=False, careful=False
+        )
+        command.execute()
@@ -1,7 +1,10 @@
+import os
 import pathlib
 import tempfile
 import unittest
 
+import pydantic
+
 from jasmin_homedir_manager.settings import DataEndpoints, Settings
 
 
@@ -23,6 +26,54 @@ class TestSettings(unittest.TestCase):
             settings.data_endpoints.users, "https://test.example.com/api/v1/users/"
         )
 
+    def test_settings_from_toml_rejects_unknown_fields(self):
+        """Test that a typo in the settings file is reported rather than ignored."""
+        fixture_path = pathlib.Path(__file__).parent / "fixtures" / "test_settings.toml"
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            settings_path = pathlib.Path(temp_dir) / "settings.toml"
+            settings_path.write_text(
+                'client_idd = "typo"\n' + fixture_path.read_text()
+            )
+
+            with self.assertRaises(pydantic.ValidationError):
+                Settings.from_toml(settings_path)
+
+    def test_settings_from_toml_reloads_changed_file(self):
+        """Test that cached settings are only reused until the file changes."""
+        fixture_path = pathlib.Path(__file__).parent / "fixtures" / "test_settings.toml"
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            settings_path = pathlib.Path(temp_dir) / "settings.toml"
+            settings_path.write_text(fixture_path.read_text())
+
+            first = Settings.from_toml(settings_path)
+            self.assertEqual(Settings.from_toml(settings_path), first)
+
+            # Replace the file, as an editor or config management would.
+            new_path = pathlib.Path(temp_dir) / "settings.toml.new"
+            new_path.write_text(
+                fixture_path.read_text().replace("test_client_id", "new_client_id")
+            )
+            os.replace(new_path, settings_path)
+
+            self.assertEqual(
+                Settings.from_toml(settings_path).client_id, "new_client_id"
+            )
+
+    def test_settings_from_toml_returns_independent_copies(self):
+        """Test that changing loaded settings does not affect later loads."""
+        fixture_path = pathlib.Path(__file__).parent / "fixtures" / "test_settings.toml"
+
+        first = Settings.from_toml(fixture_path)
+        first.data_endpoints.bulk_users = "https://test.example.com/api/users/bulk/"
+        first.scopes.append("other.scope")
+
+        second = Settings.from_toml(fixture_path)
+
+        self.assertIsNone(second.data_endpoints.bulk_users)
+        self.assertEqual(second.scopes, ["test.scope.read", "test.scope.write"])
+
     def test_settings_validation_missing_required_fields(self):
         """Test that settings validation fails when required fields are missing."""
         with tempfile.NamedTemporaryFile(
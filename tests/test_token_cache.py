@@ -0,0 +1,131 @@
+"""Tests for the on-disk token cache."""
+
+import concurrent.futures
+import pathlib
+import stat
+import tempfile
+import time
+import unittest
+
+from jasmin_homedir_manager import token_cache
+
+CLIENT_ID = "test_client"
+TOKEN_ENDPOINT = "https://test.example.com/oauth/token/"
+SCOPE = "test.scope"
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        """Create a directory for the cache file."""
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.cache_file = pathlib.Path(self.temp_dir) / "cache" / "token.json"
+
+    def make_token(self, lifetime: float) -> dict:
+        """Make a token which expires after the given number of seconds."""
+        return {
+            "access_token": "test_token",
+            "token_type": "Bearer",
+            "expires_at": time.time() + lifetime,
+        }
+
+    def test_save_and_load_token(self):
+        """Test that a saved token can be loaded again."""
+        token = self.make_token(3600)
+        token_cache.save_token(
+            self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE, token
+        )
+
+        loaded = token_cache.load_token(
+            self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE
+        )
+
+        self.assertEqual(loaded, token)
+
+    def test_saved_token_is_private(self):
+        """Test that the cache file is only readable by its owner."""
+        token_cache.save_token(
+            self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE, self.make_token(3600)
+        )
+
+        self.assertEqual(stat.S_IMODE(self.cache_file.stat().st_mode), 0o600)
+
+    def test_load_token_nearly_expired(self):
+        """Test that a token close to expiry is not reused."""
+        token_cache.save_token(
+            self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE, self.make_token(30)
+        )
+
+        self.assertIsNone(
+            token_cache.load_token(self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE)
+        )
+
+    def test_load_token_for_other_client(self):
+        """Test that a token cached for a different client is not reused."""
+        token_cache.save_token(
+            self.cache_file,
+            "other_client",
+            TOKEN_ENDPOINT,
+            SCOPE,
+            self.make_token(3600),
+        )
+
+        self.assertIsNone(
+            token_cache.load_token(self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE)
+        )
+
+    def test_load_token_for_other_scope(self):
+        """Test that a token cached for different scopes is not reused."""
+        token_cache.save_token(
+            self.cache_file,
+            CLIENT_ID,
+            TOKEN_ENDPOINT,
+            "other.scope",
+            self.make_token(3600),
+        )
+
+        self.assertIsNone(
+            token_cache.load_token(self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE)
+        )
+
+    def test_save_token_without_expiry(self):
+        """Test that a token with no expiry time is not cached."""
+        token = self.make_token(3600)
+        del token["expires_at"]
+
+        token_cache.save_token(
+            self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE, token
+        )
+
+        self.assertFalse(self.cache_file.exists())
+
+    def test_load_token_missing_or_corrupt(self):
+        """Test that a missing or unreadable cache is treated as empty."""
+        self.assertIsNone(
+            token_cache.load_token(self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE)
+        )
+
+        self.cache_file.parent.mkdir()
+        self.cache_file.write_text("not json")
+        self.assertIsNone(
+            token_cache.load_token(self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE)
+        )
+
+    def test_concurrent_saves(self):
+        """Test that saves from several threads at once all succeed."""
+        token = self.make_token(3600)
+
+        def save(_):
+            token_cache.save_token(
+                self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE, token
+            )
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(save, range(200)))
+
+        self.assertEqual(
+            token_cache.load_token(self.cache_file, CLIENT_ID, TOKEN_ENDPOINT, SCOPE),
+            token,
+        )
+        self.assertEqual(list(self.cache_file.parent.iterdir()), [self.cache_file])
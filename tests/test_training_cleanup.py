@@ -1,64 +1,121 @@
 """Tests for the training account cleanup command."""
 
+import functools
 import json
+import os
 import pathlib
-import shutil
 import tempfile
+import threading
+import time
 import unittest
 import unittest.mock
 
-from jasmin_homedir_manager.commands.training_cleanup import \
-    TrainingCleanupCommand
+import click
+import httpx
+
+from jasmin_homedir_manager.commands.training_cleanup import (
+    TrainingCleanupCommand, _is_directory)
 from jasmin_homedir_manager.settings import Settings
 
 
-class TestTrainingCleanupCommand(unittest.TestCase):
+@functools.cache
+def api_fixtures():
+    """Load the API response fixtures once, when a test first needs them."""
+    return json.loads(
+        (pathlib.Path(__file__).parent / "fixtures" / "api_responses.json").read_bytes()
+    )
 
-    @classmethod
-    def setUpClass(cls):
-        """Load API response fixtures once for all tests."""
-        fixtures_path = (
-            pathlib.Path(__file__).parent / "fixtures" / "api_responses.json"
-        )
-        with open(fixtures_path) as f:
-            cls.api_fixtures = json.load(f)
+# Settings shared by all tests, copied in setUp with a per-test home directory folder.
+BASE_SETTINGS = Settings(
+    client_id="test_client",
+    client_secret="test_secret",
+    scopes=["test.scope"],
+    token_endpoint="https://test.example.com/oauth/token/",
+    home_dir_folder=pathlib.Path("/nonexistent"),
+    data_endpoints={"users": "https://test.example.com/api/users/"},
+)
+
+
+class FakeResponse:
+    """Stand-in for an httpx.Response, much cheaper to make than a MagicMock."""
+
+    __slots__ = ("data", "status_code")
+
+    def __init__(self, data=None, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    @property
+    def is_error(self):
+        return self.status_code >= 400
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.is_error:
+            raise httpx.HTTPStatusError(
+                f"Status {self.status_code}", request=None, response=self
+            )
+
+
+class TestTrainingCleanupCommand(unittest.TestCase):
 
     def setUp(self):
         """Create fake filesystem for testing deletion process."""
-        self.temp_dir = tempfile.mkdtemp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
         self.temp_home_dir = pathlib.Path(self.temp_dir) / "home" / "users"
         self.temp_home_dir.mkdir(parents=True)
 
-        self.test_settings = Settings(
-            client_id="test_client",
-            client_secret="test_secret",
-            scopes=["test.scope"],
-            token_endpoint="https://test.example.com/oauth/token/",
-            home_dir_folder=self.temp_home_dir,
-            data_endpoints={"users": "https://test.example.com/api/users/"},
+        # Deep copy, as some tests change the data endpoints.
+        self.test_settings = BASE_SETTINGS.model_copy(
+            update={"home_dir_folder": self.temp_home_dir}, deep=True
         )
 
-    def tearDown(self):
-        """Clean up."""
-        shutil.rmtree(self.temp_dir)
+        # Never run the real mkhomedir_helper from the tests.
+        patcher = unittest.mock.patch("subprocess.run")
+        self.mock_subprocess = patcher.start()
+        self.addCleanup(patcher.stop)
 
     def create_test_user_home_directory(self, username: str) -> pathlib.Path:
         """Create a test user home directory."""
         user_home = self.temp_home_dir / username
         user_home.mkdir()
-        (user_home / "test_file.txt").write_text("test content")
+        (user_home / "test_file.txt").touch()
         (user_home / "test_dir").mkdir()
-        (user_home / "test_dir" / "nested_file.txt").write_text("nested content")
+        (user_home / "test_dir" / "nested_file.txt").touch()
         return user_home
 
     def get_mock_api_response(self, fixture_key: str, homeDirectory=None):
         """Get mock API response from fixture."""
-        response_data = self.api_fixtures[fixture_key].copy()
-
-        # Allow overriding home directory location.
-        if homeDirectory is not None:
-            response_data["account"]["homeDirectory"] = homeDirectory
-        return response_data
+        response_data = api_fixtures()[fixture_key]
+        if homeDirectory is None:
+            return response_data
+
+        # Allow overriding home directory location, including in expanded user lists.
+        # The fixture is shared, so build new dicts rather than changing it.
+        def with_home_directory(user):
+            return {
+                **user,
+                "account": {**user["account"], "homeDirectory": homeDirectory},
+            }
+
+        if isinstance(response_data, list):
+            return [with_home_directory(user) for user in response_data]
+        return with_home_directory(response_data)
+
+    def mock_client(self, *responses):
+        """Make a mock API client, whose GETs return the given responses in turn."""
+        mock_client = unittest.mock.MagicMock()
+        mock_client.get.side_effect = [
+            response if isinstance(response, Exception) else FakeResponse(response)
+            for response in responses
+        ]
+        mock_client.post.return_value = FakeResponse()
+        mock_client.patch.return_value = FakeResponse()
+        return mock_client
 
     def test_execute_with_training_users_success(self):
         """Test successful cleanup of training users."""
@@ -75,273 +132,682 @@ class TestTrainingCleanupCommand(unittest.TestCase):
             "user_detail_train002", homeDirectory=str(train_user2_home)
         )
 
+        # Mock the users list and detail requests
+        mock_client = self.mock_client(
+            users_list_response, user_detail_train001, user_detail_train002
+        )
         command = TrainingCleanupCommand(
-            self.test_settings, dry_run=False, careful=False
+            self.test_settings, dry_run=False, careful=False, client=mock_client
         )
 
-        with unittest.mock.patch.object(
-            command, "get_authenticated_client"
-        ) as mock_get_client:
-            mock_client = unittest.mock.MagicMock()
-            mock_get_client.return_value = mock_client
+        command.execute()
 
-            # Mock the initial users list request
-            mock_client.get.side_effect = [
-                unittest.mock.MagicMock(json=lambda: users_list_response),
-                unittest.mock.MagicMock(json=lambda: user_detail_train001),
-                unittest.mock.MagicMock(json=lambda: user_detail_train002),
-            ]
+        # Verify directories were removed
+        self.assertFalse(train_user1_home.exists())
+        self.assertFalse(train_user2_home.exists())
 
-            with unittest.mock.patch("subprocess.run") as mock_subprocess:
-                command.execute()
+        # Verify they were moved to .fast-remove
+        removed = sorted(
+            p.name for p in (self.temp_home_dir / ".fast-remove").iterdir()
+        )
+        self.assertEqual(len(removed), 2)
+        self.assertTrue(removed[0].startswith("train001-"))
+        self.assertTrue(removed[1].startswith("train002-"))
+
+        # Verify new home directories were created
+        self.assertEqual(
+            self.mock_subprocess.call_args_list,
+            [
+                unittest.mock.call(
+                    ["/usr/sbin/mkhomedir_helper", "train001"], check=False
+                ),
+                unittest.mock.call(
+                    ["/usr/sbin/mkhomedir_helper", "train002"], check=False
+                ),
+            ],
+        )
 
-                # Verify directories were removed
-                self.assertFalse(train_user1_home.exists())
-                self.assertFalse(train_user2_home.exists())
-
-                # Verify subprocess calls to create new home directories
-                expected_calls = [
-                    unittest.mock.call(
-                        ["/usr/sbin/mkhomedir_helper", "train001"], check=False
-                    ),
-                    unittest.mock.call(
-                        ["/usr/sbin/mkhomedir_helper", "train002"], check=False
-                    ),
-                ]
-                mock_subprocess.assert_has_calls(expected_calls, any_order=True)
-
-                # Verify API calls to update user lifecycle state
-                expected_patch_calls = [
-                    unittest.mock.call(
-                        "https://test.example.com/api/users/train001/",
-                        data={"lifecycle_state": "NORMAL"},
-                    ),
-                    unittest.mock.call(
-                        "https://test.example.com/api/users/train002/",
-                        data={"lifecycle_state": "NORMAL"},
-                    ),
-                ]
-                mock_client.patch.assert_has_calls(expected_patch_calls, any_order=True)
+        # Verify API calls to update user lifecycle state. They are made in
+        # parallel, so compare them regardless of order.
+        self.assertCountEqual(
+            [
+                (call.args, call.kwargs)
+                for call in mock_client.patch.call_args_list
+            ],
+            [
+                (
+                    ("https://test.example.com/api/users/train001/",),
+                    {"data": {"lifecycle_state": "DORMANT"}},
+                ),
+                (
+                    ("https://test.example.com/api/users/train002/",),
+                    {"data": {"lifecycle_state": "DORMANT"}},
+                ),
+            ],
+        )
 
-    def test_execute_with_dry_run_mode(self):
-        """Test dry run mode doesn't make actual changes."""
-        train_user_home = self.create_test_user_home_directory("train001")
+    def test_execute_with_bulk_users_endpoint(self):
+        """Test that cleaned up users are updated in one bulk request."""
+        train_user1_home = self.create_test_user_home_directory("train001")
+        train_user2_home = self.create_test_user_home_directory("train002")
 
-        users_list_response = self.get_mock_api_response("users_list_single_training")
-        user_detail_response = self.get_mock_api_response(
-            "user_detail_train001", homeDirectory=str(train_user_home)
+        users_list_response = self.get_mock_api_response("users_list_training")
+        user_detail_train001 = self.get_mock_api_response(
+            "user_detail_train001", homeDirectory=str(train_user1_home)
+        )
+        user_detail_train002 = self.get_mock_api_response(
+            "user_detail_train002", homeDirectory=str(train_user2_home)
         )
 
+        self.test_settings.data_endpoints.bulk_users = (
+            "https://test.example.com/api/users/bulk/"
+        )
+        mock_client = self.mock_client(
+            users_list_response, user_detail_train001, user_detail_train002
+        )
         command = TrainingCleanupCommand(
-            self.test_settings, dry_run=True, careful=False
+            self.test_settings, dry_run=False, careful=False, client=mock_client
         )
 
-        with unittest.mock.patch.object(
-            command, "get_authenticated_client"
-        ) as mock_get_client:
-            mock_client = unittest.mock.MagicMock()
-            mock_get_client.return_value = mock_client
+        mock_client.post.return_value = FakeResponse(status_code=200)
+
+        command.execute()
+
+        mock_client.post.assert_called_once_with(
+            "https://test.example.com/api/users/bulk/",
+            json=[
+                {
+                    "url": "https://test.example.com/api/users/train001/",
+                    "lifecycle_state": "DORMANT",
+                },
+                {
+                    "url": "https://test.example.com/api/users/train002/",
+                    "lifecycle_state": "DORMANT",
+                },
+            ],
+        )
+        mock_client.patch.assert_not_called()
 
-            mock_client.get.side_effect = [
-                unittest.mock.MagicMock(json=lambda: users_list_response),
-                unittest.mock.MagicMock(json=lambda: user_detail_response),
-            ]
+    def test_execute_with_failed_bulk_users_request(self):
+        """Test that users are updated one by one if the bulk request fails."""
+        users_list_response = self.get_mock_api_response("users_list_single_training")
 
-            with unittest.mock.patch("subprocess.run") as mock_subprocess:
-                command.execute()
+        self.test_settings.data_endpoints.bulk_users = (
+            "https://test.example.com/api/users/bulk/"
+        )
 
-                # Verify directories still exist (not moved)
-                self.assertTrue(train_user_home.exists())
-                self.assertTrue((train_user_home / "test_file.txt").exists())
+        for outcome in (
+            FakeResponse(status_code=404),
+            FakeResponse(status_code=405),
+            FakeResponse(status_code=500),
+            httpx.ReadTimeout("timed out"),
+        ):
+            with self.subTest(outcome=outcome):
+                train_user_home = self.create_test_user_home_directory("train001")
+                user_detail_response = self.get_mock_api_response(
+                    "user_detail_train001", homeDirectory=str(train_user_home)
+                )
+                mock_client = self.mock_client(
+                    users_list_response, user_detail_response
+                )
+                command = TrainingCleanupCommand(
+                    self.test_settings, dry_run=False, careful=False, client=mock_client
+                )
+
+                mock_client.post.side_effect = [outcome]
+
+                with self.assertLogs("TrainingCleanupCommand", "WARNING"):
+                    command.execute()
 
-                # Verify no subprocess calls were made
-                mock_subprocess.assert_not_called()
+                mock_client.post.assert_called_once()
+                mock_client.patch.assert_called_once_with(
+                    "https://test.example.com/api/users/train001/",
+                    data={"lifecycle_state": "DORMANT"},
+                )
 
-                # Verify no API patch calls were made
-                mock_client.patch.assert_not_called()
+    def test_execute_logs_failed_lifecycle_updates(self):
+        """Test that every user is updated even if updating some of them fails."""
+        train_user1_home = self.create_test_user_home_directory("train001")
+        train_user2_home = self.create_test_user_home_directory("train002")
 
-    def test_execute_skips_non_training_users(self):
-        """Test that non-training users are skipped."""
-        regular_user_home = self.create_test_user_home_directory("regularuser")
+        users_list_response = self.get_mock_api_response("users_list_training")
+        user_detail_train001 = self.get_mock_api_response(
+            "user_detail_train001", homeDirectory=str(train_user1_home)
+        )
+        user_detail_train002 = self.get_mock_api_response(
+            "user_detail_train002", homeDirectory=str(train_user2_home)
+        )
 
-        users_list_response = self.get_mock_api_response("users_list_non_training")
-        user_detail_response = self.get_mock_api_response(
-            "user_detail_regularuser", homeDirectory=str(regular_user_home)
+        mock_client = self.mock_client(
+            users_list_response, user_detail_train001, user_detail_train002
+        )
+        command = TrainingCleanupCommand(
+            self.test_settings, dry_run=False, careful=False, client=mock_client
+        )
+
+        mock_client.patch.side_effect = [
+            httpx.ReadTimeout("timed out"),
+            FakeResponse(status_code=500),
+        ]
+
+        with self.assertLogs("TrainingCleanupCommand", "ERROR") as logs:
+            command.execute()
+
+        self.assertEqual(mock_client.patch.call_count, 2)
+        self.assertEqual(
+            [record.getMessage() for record in logs.records],
+            [
+                "Failed to mark train001 as dormant",
+                "Failed to mark train002 as dormant: status 500",
+            ],
+        )
+
+    def test_execute_continues_after_user_lookup_fails(self):
+        """Test that a failed lookup for one user does not stop the others."""
+        train_user1_home = self.create_test_user_home_directory("train001")
+        train_user2_home = self.create_test_user_home_directory("train002")
+
+        users_list_response = self.get_mock_api_response("users_list_training")
+        user_detail_train001 = self.get_mock_api_response(
+            "user_detail_train001", homeDirectory=str(train_user1_home)
         )
 
+        mock_client = self.mock_client(
+            users_list_response, user_detail_train001, httpx.ReadTimeout("timed out")
+        )
         command = TrainingCleanupCommand(
-            self.test_settings, dry_run=False, careful=False
+            self.test_settings, dry_run=False, careful=False, client=mock_client
+        )
+
+        with self.assertLogs("TrainingCleanupCommand", "ERROR"):
+            command.execute()
+
+        # Verify only train001 was cleaned up, and fully
+        self.assertFalse(train_user1_home.exists())
+        self.assertTrue(train_user2_home.exists())
+        self.mock_subprocess.assert_called_once_with(
+            ["/usr/sbin/mkhomedir_helper", "train001"], check=False
+        )
+        mock_client.patch.assert_called_once_with(
+            "https://test.example.com/api/users/train001/",
+            data={"lifecycle_state": "DORMANT"},
+        )
+
+    def test_execute_finishes_users_after_rename_fails(self):
+        """Test that users already moved are finished even if another move fails."""
+        train_user1_home = self.create_test_user_home_directory("train001")
+        train_user2_home = self.create_test_user_home_directory("train002")
+
+        users_list_response = self.get_mock_api_response("users_list_training")
+        user_detail_train001 = self.get_mock_api_response(
+            "user_detail_train001", homeDirectory=str(train_user1_home)
+        )
+        user_detail_train002 = self.get_mock_api_response(
+            "user_detail_train002", homeDirectory=str(train_user2_home)
         )
 
-        with unittest.mock.patch.object(
-            command, "get_authenticated_client"
-        ) as mock_get_client:
-            mock_client = unittest.mock.MagicMock()
-            mock_get_client.return_value = mock_client
+        mock_client = self.mock_client(
+            users_list_response, user_detail_train001, user_detail_train002
+        )
+        command = TrainingCleanupCommand(
+            self.test_settings, dry_run=False, careful=False, client=mock_client
+        )
 
-            mock_client.get.side_effect = [
-                unittest.mock.MagicMock(json=lambda: users_list_response),
-                unittest.mock.MagicMock(json=lambda: user_detail_response),
-            ]
+        def rename(source, destination):
+            if source == train_user2_home:
+                raise PermissionError(source)
+            os.replace(source, destination)
 
-            with unittest.mock.patch("subprocess.run") as mock_subprocess:
+        with unittest.mock.patch("os.rename", side_effect=rename):
+            with self.assertLogs("TrainingCleanupCommand", "ERROR"):
                 command.execute()
 
-                # Verify directory still exists (not cleaned up)
-                self.assertTrue(regular_user_home.exists())
+        self.assertFalse(train_user1_home.exists())
+        self.assertTrue(train_user2_home.exists())
+        self.mock_subprocess.assert_called_once_with(
+            ["/usr/sbin/mkhomedir_helper", "train001"], check=False
+        )
+        mock_client.patch.assert_called_once_with(
+            "https://test.example.com/api/users/train001/",
+            data={"lifecycle_state": "DORMANT"},
+        )
 
-                # Verify no subprocess or patch calls
-                mock_subprocess.assert_not_called()
-                mock_client.patch.assert_not_called()
+    def test_execute_finishes_users_moved_after_interrupt(self):
+        """Test that users still being moved when interrupted are finished too."""
+        train_user1_home = self.create_test_user_home_directory("train001")
+        train_user2_home = self.create_test_user_home_directory("train002")
 
-    def test_execute_skips_mismatched_home_directory(self):
-        """Test that users with mismatched home directories are skipped."""
-        train_user_home = self.create_test_user_home_directory("train001")
+        users_list_response = self.get_mock_api_response("users_list_training")
+        user_detail_train001 = self.get_mock_api_response(
+            "user_detail_train001", homeDirectory=str(train_user1_home)
+        )
+        user_detail_train002 = self.get_mock_api_response(
+            "user_detail_train002", homeDirectory=str(train_user2_home)
+        )
 
-        users_list_response = self.get_mock_api_response("users_list_single_training")
-        user_detail_response = self.get_mock_api_response("user_detail_mismatched_home")
+        mock_client = self.mock_client(
+            users_list_response, user_detail_train001, user_detail_train002
+        )
+        command = TrainingCleanupCommand(
+            self.test_settings,
+            dry_run=False,
+            careful=False,
+            workers=2,
+            client=mock_client,
+        )
+
+        # Interrupt while waiting for train001, with train002 still being moved.
+        started = threading.Event()
+
+        def rename(source, destination):
+            if source == train_user1_home:
+                started.wait(timeout=5)
+                raise KeyboardInterrupt
+            started.set()
+            time.sleep(0.05)
+            os.replace(source, destination)
+
+        with unittest.mock.patch("os.rename", side_effect=rename):
+            with self.assertRaises(KeyboardInterrupt):
+                command.execute()
+
+        self.assertTrue(train_user1_home.exists())
+        self.assertFalse(train_user2_home.exists())
+        self.mock_subprocess.assert_called_once_with(
+            ["/usr/sbin/mkhomedir_helper", "train002"], check=False
+        )
+        mock_client.patch.assert_called_once_with(
+            "https://test.example.com/api/users/train002/",
+            data={"lifecycle_state": "DORMANT"},
+        )
+
+    def test_iter_users_follows_pagination(self):
+        """Test that all pages of a paginated users list are read."""
+        page1 = self.get_mock_api_response("users_list_training_page1")
+        page2 = self.get_mock_api_response("users_list_training_page2")
 
         command = TrainingCleanupCommand(
             self.test_settings, dry_run=False, careful=False
         )
 
-        with unittest.mock.patch.object(
-            command, "get_authenticated_client"
-        ) as mock_get_client:
-            mock_client = unittest.mock.MagicMock()
-            mock_get_client.return_value = mock_client
+        mock_client = unittest.mock.MagicMock()
+        mock_client.get.side_effect = [
+            FakeResponse(page1),
+            FakeResponse(page2),
+        ]
 
-            mock_client.get.side_effect = [
-                unittest.mock.MagicMock(json=lambda: users_list_response),
-                unittest.mock.MagicMock(json=lambda: user_detail_response),
-            ]
+        users = list(command.iter_users(mock_client))
 
-            with unittest.mock.patch("subprocess.run") as mock_subprocess:
-                command.execute()
+        self.assertEqual([u["username"] for u in users], ["train001", "train002"])
 
-                # Verify directory still exists (not cleaned up)
-                self.assertTrue(train_user_home.exists())
+        # Verify the filter is only sent on the first request
+        first_call, second_call = mock_client.get.call_args_list
+        self.assertEqual(first_call.args[0], "https://test.example.com/api/users/")
+        self.assertEqual(first_call.kwargs["params"]["user_type"], "TRAINING")
+        self.assertEqual(
+            second_call.args[0], "https://test.example.com/api/users/?page=2"
+        )
+        self.assertIsNone(second_call.kwargs["params"])
 
-                # Verify no subprocess or patch calls
-                mock_subprocess.assert_not_called()
-                mock_client.patch.assert_not_called()
+    def test_iter_users_raises_on_error_response(self):
+        """Test that a rejected users list request fails with the HTTP status."""
+        command = TrainingCleanupCommand(self.test_settings)
 
-    def test_execute_skips_nonexistent_home_directory(self):
-        """Test that users with non-existent home directories are skipped."""
-        users_list_response = self.get_mock_api_response("users_list_single_training")
+        mock_client = unittest.mock.MagicMock()
+        mock_client.get.return_value = FakeResponse(status_code=401)
 
-        # Home directory path is correct but doesn't exist
-        nonexistent_home = self.temp_home_dir / "train001"
+        with self.assertRaises(httpx.HTTPStatusError):
+            list(command.iter_users(mock_client))
+
+    def test_execute_with_multiple_workers(self):
+        """Test that users are cleaned up correctly when run in parallel."""
+        train_user1_home = self.create_test_user_home_directory("train001")
+        train_user2_home = self.create_test_user_home_directory("train002")
+
+        responses = {
+            self.test_settings.data_endpoints.users: self.get_mock_api_response(
+                "users_list_training"
+            ),
+            "https://test.example.com/api/users/train001/": self.get_mock_api_response(
+                "user_detail_train001", homeDirectory=str(train_user1_home)
+            ),
+            "https://test.example.com/api/users/train002/": self.get_mock_api_response(
+                "user_detail_train002", homeDirectory=str(train_user2_home)
+            ),
+        }
+
+        mock_client = self.mock_client()
+        command = TrainingCleanupCommand(
+            self.test_settings,
+            dry_run=False,
+            careful=False,
+            workers=2,
+            client=mock_client,
+        )
+
+        # Requests may arrive in any order, so look responses up by URL
+        mock_client.get.side_effect = lambda url, **kwargs: FakeResponse(
+            responses[url]
+        )
+
+        command.execute()
+
+        self.assertFalse(train_user1_home.exists())
+        self.assertFalse(train_user2_home.exists())
+        self.assertCountEqual(
+            [call.args[0][-1] for call in self.mock_subprocess.call_args_list],
+            ["train001", "train002"],
+        )
+        self.assertCountEqual(
+            [call.args[0] for call in mock_client.patch.call_args_list],
+            [
+                "https://test.example.com/api/users/train001/",
+                "https://test.example.com/api/users/train002/",
+            ],
+        )
+
+    def test_execute_with_dry_run_mode(self):
+        """Test dry run mode doesn't make actual changes."""
+        train_user_home = self.create_test_user_home_directory("train001")
+
+        users_list_response = self.get_mock_api_response("users_list_single_training")
         user_detail_response = self.get_mock_api_response(
-            "user_detail_nonexistent_home", homeDirectory=str(nonexistent_home)
+            "user_detail_train001", homeDirectory=str(train_user_home)
         )
 
+        mock_client = self.mock_client(users_list_response, user_detail_response)
         command = TrainingCleanupCommand(
-            self.test_settings, dry_run=False, careful=False
+            self.test_settings, dry_run=True, careful=False, client=mock_client
         )
 
-        with unittest.mock.patch.object(
-            command, "get_authenticated_client"
-        ) as mock_get_client:
-            mock_client = unittest.mock.MagicMock()
-            mock_get_client.return_value = mock_client
+        with unittest.mock.patch("click.echo") as mock_echo:
+            command.execute()
 
-            mock_client.get.side_effect = [
-                unittest.mock.MagicMock(json=lambda: users_list_response),
-                unittest.mock.MagicMock(json=lambda: user_detail_response),
-            ]
+        # Verify the users were reported together
+        output = [call.args[0] for call in mock_echo.call_args_list]
+        self.assertEqual(output[0], "[DRY RUN] Would clean up 1 users:")
+        self.assertIn(f"train001             {train_user_home}", output[1])
 
-            with unittest.mock.patch("subprocess.run") as mock_subprocess:
-                command.execute()
+        # Verify directories still exist (not moved)
+        self.assertTrue(train_user_home.exists())
+        self.assertTrue((train_user_home / "test_file.txt").exists())
+
+        # Verify no subprocess calls were made
+        self.mock_subprocess.assert_not_called()
+
+        # Verify no API patch calls were made
+        mock_client.patch.assert_not_called()
+
+    def test_execute_uses_expanded_user_list(self):
+        """Test that no detail request is made when the list has account details."""
+        train_user_home = self.create_test_user_home_directory("train001")
 
-                # Verify no subprocess or patch calls
-                mock_subprocess.assert_not_called()
-                mock_client.patch.assert_not_called()
+        users_list_response = self.get_mock_api_response(
+            "users_list_single_training_expanded", homeDirectory=str(train_user_home)
+        )
 
-    def test_confirm_user_cleanup_careful_mode_yes(self):
-        """Test user confirmation in careful mode when user says yes."""
+        mock_client = self.mock_client(users_list_response)
         command = TrainingCleanupCommand(
-            self.test_settings, dry_run=False, careful=True
+            self.test_settings, dry_run=False, careful=False, client=mock_client
         )
 
-        user = {"username": "train001"}
-        home_dir = pathlib.Path("/home/users/train001")
+        command.execute()
 
-        with unittest.mock.patch("click.prompt", return_value="yes"):
-            result = command.confirm_user_cleanup(user, home_dir, careful=True)
-            self.assertTrue(result)
+        # Verify only the list request was made, asking for expanded users
+        mock_client.get.assert_called_once()
+        self.assertEqual(
+            mock_client.get.call_args.kwargs["params"]["expand"], "account"
+        )
 
-    def test_confirm_user_cleanup_careful_mode_skip(self):
-        """Test user confirmation in careful mode when user says skip."""
+        # Verify the user was still cleaned up
+        self.assertFalse(train_user_home.exists())
+        self.mock_subprocess.assert_called_once()
+        self.assertEqual(self.mock_subprocess.call_args.args[0][-1], "train001")
+
+    def run_execute(self, *responses, careful=False, prompt_answers=()):
+        """Run a cleanup against mock API responses, returning the mock client."""
+        mock_client = self.mock_client(*responses)
         command = TrainingCleanupCommand(
-            self.test_settings, dry_run=False, careful=True
+            self.test_settings, dry_run=False, careful=careful, client=mock_client
         )
 
-        user = {"username": "train001"}
-        home_dir = pathlib.Path("/home/users/train001")
+        with unittest.mock.patch("click.prompt", side_effect=prompt_answers):
+            command.execute()
 
-        with unittest.mock.patch("click.prompt", return_value="skip"):
-            result = command.confirm_user_cleanup(user, home_dir, careful=True)
-            self.assertFalse(result)
+        return mock_client
 
-    def test_confirm_user_cleanup_careful_mode_abort(self):
-        """Test user confirmation in careful mode when user says abort."""
-        import click
+    def assert_nothing_done(self, mock_client):
+        """Assert no home directories were created and no users were updated."""
+        self.mock_subprocess.assert_not_called()
+        mock_client.patch.assert_not_called()
+        mock_client.post.assert_not_called()
 
-        command = TrainingCleanupCommand(
-            self.test_settings, dry_run=False, careful=True
+    def test_execute_skips_non_training_users(self):
+        """Test that non-training users are skipped."""
+        regular_user_home = self.create_test_user_home_directory("regularuser")
+
+        mock_client = self.run_execute(
+            self.get_mock_api_response("users_list_non_training"),
+            self.get_mock_api_response(
+                "user_detail_regularuser", homeDirectory=str(regular_user_home)
+            ),
         )
 
-        user = {"username": "train001"}
-        home_dir = pathlib.Path("/home/users/train001")
+        # Verify directory still exists (not cleaned up)
+        self.assertTrue(regular_user_home.exists())
+        self.assert_nothing_done(mock_client)
 
-        with unittest.mock.patch("click.prompt", return_value="abort"):
-            with self.assertRaises(click.Abort):
-                command.confirm_user_cleanup(user, home_dir, careful=True)
+    def test_execute_skips_mismatched_home_directory(self):
+        """Test that users with mismatched home directories are skipped."""
+        train_user_home = self.create_test_user_home_directory("train001")
 
-    def test_confirm_user_cleanup_not_careful_mode(self):
-        """Test user confirmation when not in careful mode."""
-        command = TrainingCleanupCommand(
-            self.test_settings, dry_run=False, careful=False
+        mock_client = self.run_execute(
+            self.get_mock_api_response("users_list_single_training"),
+            self.get_mock_api_response("user_detail_mismatched_home"),
         )
 
-        user = {"username": "train001"}
-        home_dir = pathlib.Path("/home/users/train001")
+        # Verify directory still exists (not cleaned up)
+        self.assertTrue(train_user_home.exists())
+        self.assert_nothing_done(mock_client)
+
+    def test_execute_skips_nonexistent_home_directory(self):
+        """Test that users with non-existent home directories are skipped."""
+        # Home directory path is correct but doesn't exist
+        nonexistent_home = self.temp_home_dir / "train001"
 
-        result = command.confirm_user_cleanup(user, home_dir, careful=False)
-        self.assertTrue(result)
+        mock_client = self.run_execute(
+            self.get_mock_api_response("users_list_single_training"),
+            self.get_mock_api_response(
+                "user_detail_nonexistent_home", homeDirectory=str(nonexistent_home)
+            ),
+        )
+
+        self.assert_nothing_done(mock_client)
+
+    def test_execute_skips_symlinked_home_directory(self):
+        """Test that a home directory which is a symlink is not followed."""
+        target = pathlib.Path(self.temp_dir) / "elsewhere"
+        target.mkdir()
+        (target / "test_file.txt").touch()
+        symlinked_home = self.temp_home_dir / "train001"
+        symlinked_home.symlink_to(target)
+
+        mock_client = self.run_execute(
+            self.get_mock_api_response("users_list_single_training"),
+            self.get_mock_api_response(
+                "user_detail_train001", homeDirectory=str(symlinked_home)
+            ),
+        )
+
+        # Verify the symlink target was left alone
+        self.assertTrue((target / "test_file.txt").exists())
+        self.assert_nothing_done(mock_client)
+
+    def test_check_user_reports_reason(self):
+        """Test that a user failing a check is returned with the reason."""
+        user = self.get_mock_api_response(
+            "users_list_single_training_expanded", homeDirectory="/home/elsewhere"
+        )[0]
+
+        command = TrainingCleanupCommand(self.test_settings)
+        candidate = command.check_user(unittest.mock.MagicMock(), user)
+
+        self.assertFalse(candidate.ok)
+        self.assertIn("did not match expected", candidate.reason)
+
+    def test_is_directory_unreadable_path(self):
+        """Test that a path which cannot be checked is not treated as a directory."""
+        with unittest.mock.patch("os.lstat", side_effect=PermissionError):
+            self.assertFalse(_is_directory(self.temp_home_dir))
+
+        not_a_directory = self.temp_home_dir / "file"
+        not_a_directory.touch()
+        self.assertFalse(_is_directory(not_a_directory / "train001"))
 
     def test_execute_with_careful_mode_skip(self):
         """Test that cleanup is skipped when user chooses skip in careful mode."""
         train_user_home = self.create_test_user_home_directory("train001")
 
-        users_list_response = self.get_mock_api_response("users_list_single_training")
-        user_detail_response = self.get_mock_api_response(
-            "user_detail_train001", homeDirectory=str(train_user_home)
+        mock_client = self.run_execute(
+            self.get_mock_api_response("users_list_single_training"),
+            self.get_mock_api_response(
+                "user_detail_train001", homeDirectory=str(train_user_home)
+            ),
+            careful=True,
+            prompt_answers=["1"],
         )
 
+        # Verify directory still exists (not cleaned up)
+        self.assertTrue(train_user_home.exists())
+        self.assert_nothing_done(mock_client)
+
+    def execute_careful(self, prompt_answers, legacy_careful=False, workers=1):
+        """Run a careful mode cleanup of train001 and train002, answering as given."""
+        train_user1_home = self.create_test_user_home_directory("train001")
+        train_user2_home = self.create_test_user_home_directory("train002")
+
+        responses = {
+            self.test_settings.data_endpoints.users: self.get_mock_api_response(
+                "users_list_training"
+            ),
+            "https://test.example.com/api/users/train001/": self.get_mock_api_response(
+                "user_detail_train001", homeDirectory=str(train_user1_home)
+            ),
+            "https://test.example.com/api/users/train002/": self.get_mock_api_response(
+                "user_detail_train002", homeDirectory=str(train_user2_home)
+            ),
+        }
+
+        mock_client = self.mock_client()
         command = TrainingCleanupCommand(
-            self.test_settings, dry_run=False, careful=True
+            self.test_settings,
+            dry_run=False,
+            careful=True,
+            workers=workers,
+            legacy_careful=legacy_careful,
+            client=mock_client,
         )
 
-        with unittest.mock.patch.object(
-            command, "get_authenticated_client"
-        ) as mock_get_client:
-            mock_client = unittest.mock.MagicMock()
-            mock_get_client.return_value = mock_client
+        # Requests may arrive in any order, so look responses up by URL
+        mock_client.get.side_effect = lambda url, **kwargs: FakeResponse(
+            responses[url]
+        )
 
-            mock_client.get.side_effect = [
-                unittest.mock.MagicMock(json=lambda: users_list_response),
-                unittest.mock.MagicMock(json=lambda: user_detail_response),
-            ]
+        with unittest.mock.patch(
+            "click.prompt", side_effect=prompt_answers
+        ) as mock_prompt:
+            command.execute()
 
-            with unittest.mock.patch("click.prompt", return_value="skip"):
-                with unittest.mock.patch("subprocess.run") as mock_subprocess:
-                    command.execute()
+        return train_user1_home, train_user2_home, mock_prompt, mock_client
+
+    def test_execute_with_careful_mode_approve_all(self):
+        """Test that answering yes once approves every listed user."""
+        train_user1_home, train_user2_home, mock_prompt, _ = self.execute_careful(
+            ["yes"]
+        )
+
+        self.assertFalse(train_user1_home.exists())
+        self.assertFalse(train_user2_home.exists())
+        mock_prompt.assert_called_once()
+
+    def test_execute_with_careful_mode_in_parallel(self):
+        """Test that careful mode still cleans up approved users in parallel."""
+        train_user1_home, train_user2_home, _, mock_client = self.execute_careful(
+            ["yes"], workers=2
+        )
+
+        self.assertFalse(train_user1_home.exists())
+        self.assertFalse(train_user2_home.exists())
+        self.assertCountEqual(
+            [call.args[0] for call in mock_client.patch.call_args_list],
+            [
+                "https://test.example.com/api/users/train001/",
+                "https://test.example.com/api/users/train002/",
+            ],
+        )
+
+    def test_execute_with_careful_mode_skip_numbers(self):
+        """Test that listed numbers are skipped and the rest approved."""
+        train_user1_home, train_user2_home, mock_prompt, _ = self.execute_careful(
+            ["2", "yes"]
+        )
+
+        self.assertFalse(train_user1_home.exists())
+        self.assertTrue(train_user2_home.exists())
+        self.assertEqual(mock_prompt.call_count, 2)
+
+    def test_execute_with_careful_mode_invalid_input(self):
+        """Test that invalid or unknown numbers are asked for again."""
+        train_user1_home, train_user2_home, mock_prompt, _ = self.execute_careful(
+            ["skip", "3", "1,2"]
+        )
 
-                    # Verify directory still exists (not cleaned up)
-                    self.assertTrue(train_user_home.exists())
+        self.assertTrue(train_user1_home.exists())
+        self.assertTrue(train_user2_home.exists())
+        self.assertEqual(mock_prompt.call_count, 3)
 
-                    # Verify no subprocess or patch calls
-                    mock_subprocess.assert_not_called()
-                    mock_client.patch.assert_not_called()
+    def test_execute_with_careful_mode_abort(self):
+        """Test that abort stops before anything is removed."""
+        with self.assertRaises(click.Abort):
+            self.execute_careful(["abort"])
+
+        self.assertTrue((self.temp_home_dir / "train001").exists())
+        self.assertTrue((self.temp_home_dir / "train002").exists())
+
+    def test_execute_with_legacy_careful_mode(self):
+        """Test that legacy careful mode prompts for each user in turn."""
+        train_user1_home, train_user2_home, mock_prompt, _ = self.execute_careful(
+            ["skip", "yes"], legacy_careful=True
+        )
+
+        self.assertTrue(train_user1_home.exists())
+        self.assertFalse(train_user2_home.exists())
+        self.assertEqual(mock_prompt.call_count, 2)
+
+
+class TestTrainingCleanupCommandOptions(unittest.TestCase):
+    """Tests which need no home directories on disk, so do without the setUp."""
+
+    def test_confirm_user_cleanup(self):
+        """Test the legacy per-user confirmation for each answer."""
+        user = {"username": "train001"}
+        home_dir = pathlib.Path("/home/users/train001")
+        # The method keeps no state between calls, so one command does for every case.
+        command = TrainingCleanupCommand(BASE_SETTINGS, careful=True)
+
+        for careful, answer, expected in [
+            (True, "yes", True),
+            (True, "skip", False),
+            (True, "abort", click.Abort),
+            (False, None, True),
+        ]:
+            with self.subTest(careful=careful, answer=answer):
+                with unittest.mock.patch("click.prompt", return_value=answer):
+                    if expected is click.Abort:
+                        with self.assertRaises(click.Abort):
+                            command.confirm_user_cleanup(user, home_dir, careful)
+                    else:
+                        self.assertEqual(
+                            command.confirm_user_cleanup(user, home_dir, careful),
+                            expected,
+                        )